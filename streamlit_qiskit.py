@@ -2,11 +2,8 @@ import streamlit as st
 
 import numpy as np
 
-from qiskit import QuantumCircuit
-from qiskit.quantum_info import Statevector
-from qiskit.visualization import plot_bloch_vector
-
-from qutip import Bloch
+import math
+from io import BytesIO
 
 
 ################################################
@@ -60,34 +57,185 @@ st.divider()
 ################################################
 
 # This function returns multiple variables:
-# 1) The (x,y,z) coordinates of the Bloch vector, given some quantum circuit
+# 1) The (x,y,z) coordinates of the Bloch vector, given the current statevector psi
 # 2) The alpha and beta coefficients solving |x> = a|0> + b|1>
 
-def get_xyz(qc):
-    sv = Statevector.from_instruction(qc)
-    alpha, beta = sv.data[0], sv.data[1]
+def get_xyz(psi):
+    alpha, beta = complex(psi[0]), complex(psi[1])
     
-    x = 2 * np.real(alpha * np.conjugate(beta))
-    y = 2 * np.imag(beta * np.conjugate(alpha))
-    z = np.abs(alpha)**2 - np.abs(beta)**2
+    # plain Python complex math is much cheaper than NumPy ufuncs on scalars
+    # note Im(beta * conj(alpha)) = -Im(alpha * conj(beta)), so one product covers x and y
+    ab = alpha * beta.conjugate()
+    x = 2 * ab.real
+    y = -2 * ab.imag
+    z = abs(alpha)**2 - abs(beta)**2
     
     return [x,y,z], alpha, beta
 
 
-# this function returns the value of Theta between vector iterations
-def get_theta(iter_pnt_list):
-    a = iter_pnt_list[-1]
-    b = iter_pnt_list[-2]
+# this function returns the value of Theta between two (x,y,z) vector iterations
+def get_theta(a, b):
+    
+    # for 3-element vectors, writing out the dot/cross products with plain floats beats NumPy dispatch
+    dot = a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+    cross = (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
     
-    return np.arccos(np.inner(a,b))
+    # atan2(|a x b|, a.b) stays accurate for small angles, where acos(a.b) loses precision (or gives NaN past 1)
+    return math.atan2(math.hypot(*cross), dot)
+
+
+# the trail of previous states is kept as two preallocated arrays of alpha and beta coefficients plus a counter,
+# which double in size when full, instead of a list that gets converted to an array every rerun
+def new_points():
+    alphas = np.empty(64, dtype=complex)
+    betas = np.empty(64, dtype=complex)
+    alphas[0], betas[0] = KET0
+    return alphas, betas
+
+def append_point(alpha, beta):
+    alphas, betas = st.session_state.alphas, st.session_state.betas
+    n_pts = st.session_state.n_pts
+    if n_pts == alphas.shape[0]:
+        alphas = np.concatenate([alphas, np.empty_like(alphas)])
+        betas = np.concatenate([betas, np.empty_like(betas)])
+        st.session_state.alphas, st.session_state.betas = alphas, betas
+    alphas[n_pts], betas[n_pts] = alpha, beta
+    st.session_state.n_pts = n_pts + 1
+
+
+# this function returns the (3, N) array of (x,y,z) points for the whole trail in one vectorized pass
+# (same formulas as get_xyz, applied to every stored alpha/beta at once)
+def trail_xyz(alphas, betas):
+    ab = alphas * betas.conj()
+    x = 2 * ab.real
+    y = -2 * ab.imag
+    z = (alphas.real**2 + alphas.imag**2) - (betas.real**2 + betas.imag**2)
+    return np.stack([x, y, z])
+
+
+# qiskit and matplotlib are slow to import,
+# so they are imported inside these functions instead of at the top of the script
+# that way the introductory text renders before the heavy libraries finish loading
+def new_circuit():
+    from qiskit import QuantumCircuit
+    return QuantumCircuit(1)
+
+# the Bloch sphere is drawn directly with a matplotlib 3D axes (instead of qutip's Bloch class)
+# the wireframe mesh never changes, so it is only computed once
+@st.cache_resource
+def sphere_mesh():
+    u, v = np.mgrid[0:2*np.pi:25j, 0:np.pi:13j]
+    return np.cos(u)*np.sin(v), np.sin(u)*np.sin(v), np.cos(v)
+
+def make_bloch():
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(2,2))
+    ax = fig.add_subplot(projection='3d')
+
+    # the sphere, the x/y/z axes and their labels
+    ax.plot_wireframe(*sphere_mesh(), color='gray', alpha=0.2, linewidth=0.5)
+    for axis in np.eye(3):
+        ax.plot(*np.stack([-axis, axis]).T, color='gray', linewidth=0.5)
+    ax.text(1.3, 0, 0, r'$x$', ha='center', va='center', fontsize=10)
+    ax.text(0, 1.25, 0, r'$y$', ha='center', va='center', fontsize=10)
+    ax.text(0, 0, 1.25, r'$\left|0\right>$', ha='center', va='center', fontsize=10)
+    ax.text(0, 0, -1.3, r'$\left|1\right>$', ha='center', va='center', fontsize=10)
+
+    ax.set_xlim(-1, 1)
+    ax.set_ylim(-1, 1)
+    ax.set_zlim(-1, 1)
+    ax.set_box_aspect((1, 1, 1))
+    ax.view_init(elev=30, azim=-60)
+    ax.set_axis_off()
+    return fig, ax, []
+
+# the figure with the static sphere is built once per session and kept in session state,
+# each redraw only swaps out the state vector and the trail of "prior" points
+def draw_bloch(vec, pts):
+    if "bloch" not in st.session_state:
+        st.session_state.bloch = make_bloch()
+    fig, ax, artists = st.session_state.bloch
+
+    for artist in artists:
+        artist.remove()
+    artists[:] = [ax.quiver(0, 0, 0, *vec, color='g', linewidth=1, arrow_length_ratio=0.15),
+                  ax.scatter(*pts, color='b', s=6, depthshade=False)]
+    return fig
+
+
+# every applied gate is recorded in st.session_state.gate_key, a tuple like (('h',), ('r', 90, 45), ...)
+# with angles in degrees, which is a cheap hashable cache key for the circuit (no QASM serialization needed)
+# the actual Qiskit circuit is only built from it when the diagram has to be drawn
+def add_to_circuit(circuit, name, angles):
+    getattr(circuit, name)(*(angle * _DEG2RAD for angle in angles), 0)
+
+def record_gate(name, *angles):
+    st.session_state.gate_key += ((name, *angles),)
+
+
+# drawing the circuit with matplotlib is the most expensive step for long circuits,
+# so the rendered image is cached on the gate_key and only redrawn when a gate is added
+@st.cache_data(max_entries=64)
+def draw_circuit(gate_key):
+    import matplotlib.pyplot as plt
+    circuit = new_circuit()
+    for name, *angles in gate_key:
+        add_to_circuit(circuit, name, angles)
+    fig = circuit.draw('mpl')
+    png = fig_to_png(fig, dpi=200)
+    plt.close(fig)
+    return png
+
+# this function renders a matplotlib figure to PNG bytes (so the image can be cached and re-displayed)
+def fig_to_png(fig, dpi=None):
+    buf = BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', dpi=dpi)
+    return buf.getvalue()
+
+
+# these functions return the 2x2 matrices for the rotation and phase gates (angles in whole degrees)
+# the sines/cosines come from the lookup tables below instead of being recomputed on every click
+def r_matrix(theta_deg, phi_deg):
+    c, s = _COS_HALF[theta_deg + 360], _SIN_HALF[theta_deg + 360]
+    e = _EXP[phi_deg + 360]
+    return np.array([[c, -1j * e.conjugate() * s],
+                     [-1j * e * s, c]], dtype=complex)
+
+def p_matrix(theta_deg):
+    return np.array([[1, 0], [0, _EXP[theta_deg + 360]]], dtype=complex)
+
+
+# this function applies a single 2x2 gate matrix to the running statevector psi (in place)
+# a single qubit is just a 2-element vector, so we don't need a full Qiskit Statevector for this
+def apply_gate(matrix):
+    get_apply2()(st.session_state.psi, matrix[0, 0], matrix[0, 1], matrix[1, 0], matrix[1, 1])
+
+# numba (which pulls in llvmlite) is slow to import and the kernel has to be compiled,
+# so both happen once per server process here instead of on every rerun
+@st.cache_resource
+def get_apply2():
+    from numba import njit
+
+    # JIT-compiled kernel for psi = [[a, b], [c, d]] @ psi, updating psi in place without NumPy temporaries
+    @njit(fastmath=True)
+    def apply2(psi, a, b, c, d):
+        x, y = psi[0], psi[1]
+        psi[0] = a*x + b*y
+        psi[1] = c*x + d*y
+
+    apply2(np.zeros(2, dtype=complex), 1+0j, 0j, 0j, 1+0j)    # warm-up call so the kernel is compiled here, on page load (see below)
+    return apply2
 
 
 #this function resets the app to default settings
+# the keys are deleted (so the old arrays can be freed right away) and re-created by init_session_state()
+STATE_KEYS = ('gate_key', 'psi', 'alphas', 'betas', 'n_pts', 'theta_dist', 'render_key', 'render_png')
+
 def reset_function():
-    st.session_state.qc = QuantumCircuit(1)
-    qc = st.session_state.qc
-    st.session_state.pnt_list = [[0.0, 0.0, 1.0]]
-    st.session_state.theta_dist = 0
+    for key in STATE_KEYS:
+        if key in st.session_state:
+            del st.session_state[key]
+
 
 ################################################
 #### GATES IN MARKDOWN
@@ -103,104 +251,148 @@ rot_text = r"""$R(\theta, \phi)= \begin{pmatrix} cos(\theta/2) & -ie^{-i\phi}sin
 phase_text = r"""$P(\theta)= \begin{pmatrix} 1 & 0 \\ 0 & e^{i\theta} \end{pmatrix} $"""
 
 ################################################
-#### SESSION STATE
-################################################
-
-# The "session state" is a Streamlit quirk
-# Without it, the entire script will be run top-to-bottom every time you hit a button
-# This now allows us to add/append gates without losing previous state information
-
-if "qc" not in st.session_state:
-    st.session_state.qc = QuantumCircuit(1)
-
-if "pnt_list" not in st.session_state:
-    st.session_state.pnt_list = [[0.0, 0.0, 1.0],[0.0, 0.0, 1.0]]
-
-if 'theta_dist' not in st.session_state:
-    st.session_state.theta_dist = 0
-
-qc = st.session_state.qc
-
-
-################################################
-#### BUTTONS FOR QUANTUM GATES
-################################################
-
-# Here are the 'standard' gates
-st.subheader('Canonical Gates')
-st.caption("""Hover your mouse over any of the gate buttons to see the corresponding 2x2 matrix transformation""")
-H, X, Y, Z = st.columns(4)
-if H.button("Hadamard", width='stretch', help=hadamard_text):
-    H.markdown('You added a Hadamard gate')
-    qc.h(0) 
-if X.button("Pauli X", width='stretch', help=paulix_text):
-    X.markdown('You added a Pauli X gate')
-    qc.x(0)
-if Y.button("Pauli Y", width='stretch', help=pauliy_text):
-    Y.markdown('You added a Pauli Y gate')
-    qc.y(0)
-if Z.button("Pauli Z", width='stretch', help=pauliz_text):
-    Z.markdown('You added a Pauli Z gate')
-    qc.z(0)
-
-# Here are the rotation gate inputs
-st.subheader('Rotations and Phase Shifts')
-st.caption("Input angles as degrees (they are converted to radians behind the scenes)")
-RotTheta, RotPhi, PhasePhi, nothing_here  = st.columns(4) # "nothing here" because I want to keep 4 columns (to make it look uniform)
-RotTheta_num = RotTheta.number_input('Theta (degrees) \n\n-180 < θ < 180', width=200, min_value=-180, max_value=180, value=0)
-RotPhi_num = RotPhi.number_input('Phi (degrees) \n\n-360 < ϕ < 360)', width=200, min_value=-360, max_value=360, value=0)
-PhasePhi_num = PhasePhi.number_input('Phase (degrees) \n\n-360 < ϕ < 360)', width=200, min_value=-360, max_value=360, value=0)
-
-# Here are the submit buttons for the rotation inputs above
-RotateButton, PhaseButton, placeholder1 = st.columns([2,1,1])
-if RotateButton.button('Rotate θ around  \n\n cos(φ)x + sin(φ)y axis', width='stretch', help=rot_text):
-    qc.r(RotTheta_num * np.pi / 180, RotPhi_num * np.pi / 180, 0)
-#if RotateButton.button('Rotate θ', width='stretch'):
-#    qc.r(RotTheta_num * np.pi / 180, 0, 0)
-if PhaseButton.button('Rotate phase around Z', width='stretch', help=phase_text):
-    qc.p(PhasePhi_num * np.pi / 180, 0)
-
-
-
-################################################
-#### PLOTTING THE BLOCH SPHERE
+#### GATE MATRICES
 ################################################
 
-bloch_vector, alpha, beta = get_xyz(qc)             # returns the Bloch Vector (Qiskit object) and the alpha/beta coefficients
-st.session_state.pnt_list.append(bloch_vector)      # this appends to a running total of previous vector iterations
-
-# instantiate the Bloch vector
-b = Bloch(figsize=(2,2))
-b.vector_width = 1
-b.font_size = 10
+# every qubit starts out as |0>, i.e. alpha = 1 and beta = 0
+KET0 = (1+0j, 0+0j)
 
-# this adds the vector to the Bloch sphere and updates the "prior" points
-b.add_vectors(bloch_vector)
-pts = np.array(st.session_state.pnt_list).T
-b.add_points(pts, meth='s')
-
-# show the figure
-b.show()
-st.pyplot(b.fig, width='content')
+GATES = {
+    'H': (1/np.sqrt(2)) * np.array([[1, 1], [1, -1]], dtype=complex),
+    'X': np.array([[0, 1], [1, 0]], dtype=complex),
+    'Y': np.array([[0, -1j], [1j, 0]], dtype=complex),
+    'Z': np.array([[1, 0], [0, -1]], dtype=complex),
+}
 
+# The angle inputs are whole degrees between -360 and 360, so there are only 721 possible values
+# These lookup tables are indexed by (degrees + 360)
+_DEG2RAD = np.pi / 180
+_RADIANS = np.arange(-360, 361) * _DEG2RAD
+_EXP = np.exp(1j * _RADIANS)
+_COS_HALF = np.cos(_RADIANS / 2)
+_SIN_HALF = np.sin(_RADIANS / 2)
 
 ################################################
-#### OTHER DATA POINTS
+#### SESSION STATE
 ################################################
 
-st.markdown(f"\n#### Final State Vector \n${np.round(alpha,3)}\ket{0} + {np.round(beta,3)}\ket{1}$")
-st.caption(r"State vector is $$\ket{\psi} = \alpha\ket{0} + \beta\ket{1}$$ where $$\|\alpha\|^{2} + \|\beta\|^{2} = 1$$")
-st.markdown(f"\nProbability of measuring $\ket{0} = {np.real(np.round(alpha * np.conj(alpha),3))}$")
-st.markdown(f"\nProbability of measuring $\ket{1} = {np.real(np.round(beta * np.conj(beta),3))}$")
-
-
-st.session_state.theta_dist += get_theta(st.session_state.pnt_list) 
-st.write(f'\n#### Distance Travelled: {np.round(st.session_state.theta_dist, 3)} radians')
-st.caption(r"Distance is $$s = \theta \cdot r$$, and $r=1$ (unit length)")
-
-st.markdown("#### The Quantum Circuit")
-st.caption("Diagram of circuits goes left-to-right")
-st.pyplot(qc.draw('mpl'))
+# The "session state" is a Streamlit quirk
+# Without it, the entire script will be run top-to-bottom every time you hit a button
+# This now allows us to add/append gates without losing previous state information
+# It is called at the start of the fragment below, so it also re-creates the keys after a reset
+# (setdefault is used for the plain constants, the rest are only built when they're actually missing)
+
+def init_session_state():
+    if "psi" not in st.session_state:
+        st.session_state.psi = np.array(KET0)
+
+    if "alphas" not in st.session_state:
+        st.session_state.alphas, st.session_state.betas = new_points()
+        st.session_state.n_pts = 1
+
+    st.session_state.setdefault('gate_key', ())
+    st.session_state.setdefault('theta_dist', 0)
+
+# Everything from the gate buttons down to the circuit diagram runs as a Streamlit fragment,
+# so clicking a gate (or changing an angle) only reruns this part instead of the whole script
+@st.fragment
+def sim_block():
+    init_session_state()
+
+    ################################################
+    #### BUTTONS FOR QUANTUM GATES
+    ################################################
+
+    # Here are the 'standard' gates
+    st.subheader('Canonical Gates')
+    st.caption("""Hover your mouse over any of the gate buttons to see the corresponding 2x2 matrix transformation""")
+    H, X, Y, Z = st.columns(4)
+    if H.button("Hadamard", width='stretch', help=hadamard_text):
+        H.markdown('You added a Hadamard gate')
+        record_gate('h')
+        apply_gate(GATES['H'])
+    if X.button("Pauli X", width='stretch', help=paulix_text):
+        X.markdown('You added a Pauli X gate')
+        record_gate('x')
+        apply_gate(GATES['X'])
+    if Y.button("Pauli Y", width='stretch', help=pauliy_text):
+        Y.markdown('You added a Pauli Y gate')
+        record_gate('y')
+        apply_gate(GATES['Y'])
+    if Z.button("Pauli Z", width='stretch', help=pauliz_text):
+        Z.markdown('You added a Pauli Z gate')
+        record_gate('z')
+        apply_gate(GATES['Z'])
+
+    # Here are the rotation gate inputs
+    st.subheader('Rotations and Phase Shifts')
+    st.caption("Input angles as degrees (they are converted to radians behind the scenes)")
+    RotTheta, RotPhi, PhasePhi, nothing_here  = st.columns(4) # "nothing here" because I want to keep 4 columns (to make it look uniform)
+    RotTheta_num = RotTheta.number_input('Theta (degrees) \n\n-180 < θ < 180', width=200, min_value=-180, max_value=180, value=0)
+    RotPhi_num = RotPhi.number_input('Phi (degrees) \n\n-360 < ϕ < 360)', width=200, min_value=-360, max_value=360, value=0)
+    PhasePhi_num = PhasePhi.number_input('Phase (degrees) \n\n-360 < ϕ < 360)', width=200, min_value=-360, max_value=360, value=0)
+
+    # Here are the submit buttons for the rotation inputs above
+    RotateButton, PhaseButton, placeholder1 = st.columns([2,1,1])
+    if RotateButton.button('Rotate θ around  \n\n cos(φ)x + sin(φ)y axis', width='stretch', help=rot_text):
+        record_gate('r', RotTheta_num, RotPhi_num)
+        apply_gate(r_matrix(RotTheta_num, RotPhi_num))
+    #if RotateButton.button('Rotate θ', width='stretch'):
+    #    qc.r(RotTheta_num * np.pi / 180, 0, 0)
+    if PhaseButton.button('Rotate phase around Z', width='stretch', help=phase_text):
+        record_gate('p', PhasePhi_num)
+        apply_gate(p_matrix(PhasePhi_num))
+
+
+
+    ################################################
+    #### PLOTTING THE BLOCH SPHERE
+    ################################################
+
+    bloch_vector, alpha, beta = get_xyz(st.session_state.psi)   # returns the Bloch vector (x,y,z) and the alpha/beta coefficients
+
+    # only add a new point (and distance) when a gate was actually applied on this rerun,
+    # otherwise changing any other widget would keep piling up duplicate points
+    if st.session_state.n_pts <= len(st.session_state.gate_key):
+        append_point(alpha, beta)                       # this appends to a running total of previous vector iterations
+        n_pts = st.session_state.n_pts
+        prev_vector, _, _ = get_xyz((st.session_state.alphas[n_pts-2], st.session_state.betas[n_pts-2]))
+        st.session_state.theta_dist += get_theta(bloch_vector, prev_vector)
+
+    # draw the vector on the Bloch sphere along with the "prior" points
+    # the picture only changes when a gate is added (the trail always has one point per gate plus the start),
+    # so the rendered PNG is kept in session state and re-displayed as-is while gate_key is unchanged
+    render_key = st.session_state.gate_key
+    if render_key != st.session_state.get('render_key'):
+        n_pts = st.session_state.n_pts
+        pts = trail_xyz(st.session_state.alphas[:n_pts], st.session_state.betas[:n_pts])
+        st.session_state.render_png = fig_to_png(draw_bloch(bloch_vector, pts), dpi=200)
+        st.session_state.render_key = render_key
+    st.image(st.session_state.render_png)
+
+
+    ################################################
+    #### OTHER DATA POINTS
+    ################################################
+
+    st.markdown(f"\n#### Final State Vector \n${np.round(alpha,3)}\ket{0} + {np.round(beta,3)}\ket{1}$")
+    st.caption(r"State vector is $$\ket{\psi} = \alpha\ket{0} + \beta\ket{1}$$ where $$\|\alpha\|^{2} + \|\beta\|^{2} = 1$$")
+    st.markdown(f"\nProbability of measuring $\ket{0} = {np.real(np.round(alpha * np.conj(alpha),3))}$")
+    st.markdown(f"\nProbability of measuring $\ket{1} = {np.real(np.round(beta * np.conj(beta),3))}$")
+
+
+    st.write(f'\n#### Distance Travelled: {np.round(st.session_state.theta_dist, 3)} radians')
+    st.caption(r"Distance is $$s = \theta \cdot r$$, and $r=1$ (unit length)")
+
+    st.markdown("#### The Quantum Circuit")
+    st.caption("Diagram of circuits goes left-to-right")
+    st.image(draw_circuit(st.session_state.gate_key), width='stretch')
+
+
+# compile the gate kernel on page load (after the header has rendered) rather than on the first gate click
+get_apply2()
+
+sim_block()
 
 
 ################################################